@@ -1,15 +1,16 @@
-from utils import start_vllm_server, stop_vllm_server, chat_completion, write_jsonl, read_jsonl
+from utils import start_vllm_server, stop_vllm_server, chat_completion, read_jsonl, iter_completed, atomic_write, client_threads
 import argparse
+import orjson
 import os
 import re
 from concurrent.futures import ThreadPoolExecutor
 
+_RATING_RE = re.compile(r'Rating\s*:\s*([1-5])', re.IGNORECASE)
+_CORRECT_PHRASES = ("the answer is correct", "the answer is approximated but should be correct")
+
 def scorer(response):
     response = response.lower()
-    if "the answer is correct" in response or "the answer is approximated but should be correct" in response:
-        return True
-    else:
-        return False
+    return any(phrase in response for phrase in _CORRECT_PHRASES)
 
 # Original system message for judge, single-choice and multi-choice evaluations.
 check_sys_msg = """You are a helpful AI assistant. You will use your coding and language skills to verify the answer.
@@ -26,54 +27,8 @@ Please do the following:
     - "The answer is incorrect. Correct Answer: <ground truth answer> | Answer extracted: <answer extracted>."
     - "The reply doesn't contain an answer." """
 
-def extract_rating(response):
-    """
-    Extract a rating (1 to 5) from the LLM response.
-    Assumes the response contains a phrase like "Rating: X" (case insensitive).
-    """
-    m = re.search(r'Rating\s*:\s*([1-5])', response, re.IGNORECASE)
-    if m:
-        return int(m.group(1))
-    else:
-        return None
-
-def eval_jsonl(path_to_jsonl, api_base, model_name, max_tokens=256, temperature=0.7, threads=10, output_file=None):
-    def process_data(data_item, api_base, model_name, max_tokens=256, temperature=0.7):
-        reference_answer = data_item.get("answer", "")
-        llm_answer = data_item.get("llm_answer", "")
-        question = data_item.get("question", "")
-        q_type = data_item.get("type", "").lower()
-        
-        # For single-choice or multi-choice, append choices if present.
-        if q_type in ["single-choice", "multi-choice"]:
-            choices = data_item.get("choices")
-            if choices:
-                question += "\nOptions:\n" + choices
-        
-        user_prompt = "Problem: " + question + f"\n\nReply: {llm_answer}\n\nGround truth answer: " + reference_answer
-        if q_type in ["open", "fill"]:
-            user_prompt = "Problem: " + question + f"\n\nReply: {llm_answer}\n\nGround truth answer: " + reference_answer + "Ground turth explanation: " + data_item.get("explanation", "")
-
-        # For judge, single-choice and multi-choice types, use the original prompt.
-        if q_type in ["judge", "single-choice", "multi-choice"]:
-            messages = [
-                {"role": "system", "content": check_sys_msg},
-                {"role": "user", "content": user_prompt}
-            ]
-            response = chat_completion(api_base=api_base, model_name=model_name, messages=messages,
-                                       max_tokens=max_tokens, temperature=temperature)
-            eval_result = scorer(response)
-            return {
-                "question": question,
-                "llm_answer": llm_answer,
-                "reference_answer": reference_answer,
-                "eval_feedback": response,
-                "eval_result": eval_result,
-                "type": q_type
-            }
-        # For fill and open types, use a rating prompt.
-        elif q_type in ["fill", "open"]:
-            rating_sys_msg = """You are a helpful AI assistant. Your task is to evaluate the quality of a given answer by comparing it with the ground truth with it explanation.
+# System message for fill and open evaluations, which are rated from 1 to 5.
+rating_sys_msg = """You are a helpful AI assistant. Your task is to evaluate the quality of a given answer by comparing it with the ground truth with it explanation.
             You are provided with:
                 1. A problem statement.
                 2. A reply containing the answer to the problem.
@@ -93,61 +48,131 @@ def eval_jsonl(path_to_jsonl, api_base, model_name, max_tokens=256, temperature=
             Ensure that your explanation clearly justifies the assigned rating.
             """
 
-            messages = [
-                {"role": "system", "content": rating_sys_msg},
-                {"role": "user", "content": user_prompt}
-            ]
-            response = chat_completion(api_base=api_base, model_name=model_name, messages=messages,
-                                       max_tokens=max_tokens, temperature=temperature)
-            rating = extract_rating(response)
-            return {
-                "question": question,
-                "llm_answer": llm_answer,
-                "reference_answer": reference_answer,
-                "eval_feedback": response,
-                "eval_rating": rating,
-                "type": q_type
-            }
-        # Fallback to judge prompt if type is unspecified or unrecognized.
+# Shared system messages; only the user message is built per item.
+check_sys_message = {"role": "system", "content": check_sys_msg}
+rating_sys_message = {"role": "system", "content": rating_sys_msg}
+
+def extract_rating(response):
+    """
+    Extract a rating (1 to 5) from the LLM response.
+    Assumes the response contains a phrase like "Rating: X" (case insensitive).
+    """
+    m = _RATING_RE.search(response)
+    return int(m.group(1)) if m else None
+
+def process_data(data_item, api_base, model_name, max_tokens=256, temperature=0.7, cache=None, timeout=600):
+    """
+    Judges a single generated answer against its reference and returns the eval record.
+    Empty or missing answers are not sent to the judge; they get the "no answer" verdict directly
+    (eval_rating 1 for fill/open, eval_result False otherwise).
+    """
+    reference_answer = data_item.get("answer", "")
+    llm_answer = data_item.get("llm_answer", "")
+    question = data_item.get("question", "")
+    q_type = data_item.get("type", "").lower()
+
+    # For single-choice or multi-choice, append choices if present.
+    if q_type in ["single-choice", "multi-choice"]:
+        choices = data_item.get("choices")
+        if choices:
+            question += "\nOptions:\n" + choices
+
+    # Fast path: nothing to judge, so skip the LLM round-trip.
+    if not llm_answer or not llm_answer.strip():
+        result = {
+            "question": question,
+            "llm_answer": llm_answer,
+            "reference_answer": reference_answer,
+            "eval_feedback": "The reply doesn't contain an answer.",
+            "type": q_type
+        }
+        if q_type in ["fill", "open"]:
+            result["eval_rating"] = 1
         else:
-            messages = [
-                {"role": "system", "content": check_sys_msg},
-                {"role": "user", "content": user_prompt}
-            ]
-            response = chat_completion(api_base=api_base, model_name=model_name, messages=messages,
-                                       max_tokens=max_tokens, temperature=temperature)
-            eval_result = scorer(response)
-            return {
-                "question": question,
-                "llm_answer": llm_answer,
-                "reference_answer": reference_answer,
-                "eval_feedback": response,
-                "eval_result": eval_result,
-                "type": q_type
-            }
-    
+            result["eval_result"] = False
+        return result
+
+    # Build the user prompt once per branch.
+    if q_type in ["open", "fill"]:
+        user_prompt = (f"Problem: {question}\n\nReply: {llm_answer}\n\nGround truth answer: {reference_answer}"
+                       f"Ground turth explanation: {data_item.get('explanation', '')}")
+    else:
+        user_prompt = f"Problem: {question}\n\nReply: {llm_answer}\n\nGround truth answer: {reference_answer}"
+
+    # For judge, single-choice and multi-choice types, use the original prompt.
+    if q_type in ["judge", "single-choice", "multi-choice"]:
+        messages = [check_sys_message, {"role": "user", "content": user_prompt}]
+        response = chat_completion(api_base=api_base, model_name=model_name, messages=messages,
+                                   max_tokens=max_tokens, temperature=temperature, cache=cache,
+                                   timeout=timeout)
+        eval_result = scorer(response)
+        return {
+            "question": question,
+            "llm_answer": llm_answer,
+            "reference_answer": reference_answer,
+            "eval_feedback": response,
+            "eval_result": eval_result,
+            "type": q_type
+        }
+    # For fill and open types, use a rating prompt.
+    elif q_type in ["fill", "open"]:
+        messages = [rating_sys_message, {"role": "user", "content": user_prompt}]
+        response = chat_completion(api_base=api_base, model_name=model_name, messages=messages,
+                                   max_tokens=max_tokens, temperature=temperature, cache=cache,
+                                   timeout=timeout)
+        rating = extract_rating(response)
+        return {
+            "question": question,
+            "llm_answer": llm_answer,
+            "reference_answer": reference_answer,
+            "eval_feedback": response,
+            "eval_rating": rating,
+            "type": q_type
+        }
+    # Fallback to judge prompt if type is unspecified or unrecognized.
+    else:
+        messages = [check_sys_message, {"role": "user", "content": user_prompt}]
+        response = chat_completion(api_base=api_base, model_name=model_name, messages=messages,
+                                   max_tokens=max_tokens, temperature=temperature, cache=cache,
+                                   timeout=timeout)
+        eval_result = scorer(response)
+        return {
+            "question": question,
+            "llm_answer": llm_answer,
+            "reference_answer": reference_answer,
+            "eval_feedback": response,
+            "eval_result": eval_result,
+            "type": q_type
+        }
+
+def eval_jsonl(path_to_jsonl, api_base, model_name, max_tokens=256, temperature=0.7, threads=10, output_file=None,
+               timeout=600):
     win_counter = 0
-    data_list = list(read_jsonl(path_to_jsonl))
-    total_counter = len(data_list)
+    total_counter = 0
     file_name = os.path.splitext(os.path.basename(path_to_jsonl))[0]
     
     # Default output file location if not provided.
     if output_file is None:
         output_file = os.path.join("eval_results", file_name + "_eval.jsonl")
     
-    output_list = []
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
     
-    with ThreadPoolExecutor(max_workers=threads) as executor:
-        futures = [executor.submit(process_data, data_item, api_base, model_name, max_tokens, temperature)
-                   for data_item in data_list]
-        for future in futures:
-            result_json = future.result()
+    # Duplicate judge prompts within this file are sent once; the cache is dropped with the file.
+    cache = {}
+    # Stream each result to disk as soon as it completes instead of buffering them all. The output
+    # is only replaced once every item is evaluated, so a failed run leaves earlier results intact.
+    with atomic_write(output_file) as f, ThreadPoolExecutor(max_workers=threads) as executor:
+        # Items are read lazily and submitted with at most threads * 2 in flight.
+        for result_json in iter_completed(executor, process_data, read_jsonl(path_to_jsonl), threads * 2,
+                                          api_base, model_name, max_tokens, temperature, cache, timeout):
+            total_counter += 1
             # For judge-style evaluation, count correct answers.
             if "eval_result" in result_json:
                 win_counter += int(result_json.get("eval_result"))
-            output_list.append(result_json)
+            f.write(orjson.dumps(result_json) + b'\n')
    
-    write_jsonl(output_file, output_list)
     print(f'[INFO] Evaluation results have been saved to {output_file}')
     if total_counter > 0:
         print(f'[INFO] Accuracy: {win_counter/total_counter*100:.2f}%')
@@ -163,23 +188,32 @@ if __name__ == "__main__":
     parser.add_argument('--model_path', type=str, default=None, help='Path to the model')
     parser.add_argument('--port', type=int, default=8000, help='Port')
     parser.add_argument('--gpu', type=int, default=1, help='GPU')
-    parser.add_argument('--threads', type=int, default=10, help='Threads')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Concurrent judge requests (default: --max_num_seqs if set, else 128)')
+    parser.add_argument('--request_timeout', type=float, default=600,
+                        help='Seconds to wait for each judge reply before retrying')
+    parser.add_argument('--max_num_seqs', type=int, default=None,
+                        help="vLLM --max-num-seqs for a server started here (vLLM's default if unset)")
     parser.add_argument('--output_file_list', type=str, default=None, help='List of output file paths')
     
     args = parser.parse_args()
+    threads = client_threads(args.threads, args.max_num_seqs)
     
-    # When a model path is provided, we start the vLLM server.
-    if args.model_path:
-        process_id = start_vllm_server(args.model_path, args.model_name, args.port, args.gpu)
-        path_json_list = args.path_to_jsonl_list.split(',')
+    path_json_list = args.path_to_jsonl_list.split(',')
+    if args.output_file_list:
         output_file_list = args.output_file_list.split(',')
-        for path_to_jsonl, output_path in zip(path_json_list, output_file_list):
-            eval_jsonl(path_to_jsonl, args.api_base, args.model_name, args.max_tokens,
-                       args.temperature, args.threads, output_path)
-        stop_vllm_server(process_id)
     else:
-        path_json_list = args.path_to_jsonl_list.split(',')
-        output_file_list = args.output_file_list.split(',')
+        output_file_list = [None] * len(path_json_list)
+    
+    # When a model path is provided, we start the vLLM server once for every input file.
+    process_id = None
+    if args.model_path:
+        process_id = start_vllm_server(args.model_path, args.model_name, args.port, args.gpu,
+                                       max_num_seqs=args.max_num_seqs)
+    try:
         for path_to_jsonl, output_path in zip(path_json_list, output_file_list):
             eval_jsonl(path_to_jsonl, args.api_base, args.model_name, args.max_tokens,
-                       args.temperature, args.threads, output_path)
+                       args.temperature, threads, output_path, args.request_timeout)
+    finally:
+        if process_id is not None:
+            stop_vllm_server(process_id)
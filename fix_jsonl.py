@@ -1,34 +1,40 @@
 import os
-import json
-import glob
-import codecs
+import orjson
+from concurrent.futures import ProcessPoolExecutor
 
-def fix_jsonl_encoding(input_folder):
+from utils import atomic_write
+
+def _fix_one(file_path):
     """
-    Reads all JSONL files in the given folder, fixes Unicode escape sequences, and rewrites the files.
+    Rewrites a single JSONL file with proper UTF-8 encoding, dropping invalid lines.
     """
-    jsonl_files = glob.glob(os.path.join(input_folder, "*.jsonl"))
+    # Stream through a temp file so memory stays flat and the original is only replaced once fully rewritten
+    with open(file_path, 'rb') as fin, atomic_write(file_path) as fout:
+        for line in fin:
+            # orjson ignores surrounding whitespace, so lines are parsed without a strip copy
+            if line.isspace():
+                continue
+            try:
+                # Load JSON while ensuring Unicode characters are interpreted correctly
+                data = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                print(f"[ERROR] Invalid JSON in {file_path}: {line.decode('utf-8', 'replace').strip()} - {e}")
+                continue
+            fout.write(orjson.dumps(data) + b'\n')  # orjson never escapes non-ASCII
 
-    for file_path in jsonl_files:
-        fixed_data = []
-        
-        # Read the file and decode any escaped Unicode sequences
-        with codecs.open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip():
-                    try:
-                        # Load JSON while ensuring Unicode characters are interpreted correctly
-                        data = json.loads(line)
-                        fixed_data.append(data)
-                    except json.JSONDecodeError as e:
-                        print(f"[ERROR] Invalid JSON in {file_path}: {line.strip()} - {e}")
+    print(f"[INFO] Fixed encoding for {file_path}")
 
-        # Write back to the file with proper UTF-8 encoding, ensuring no escape sequences
-        with open(file_path, 'w', encoding='utf-8') as f:
-            for item in fixed_data:
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')  # No escaping
+def fix_jsonl_encoding(input_folder):
+    """
+    Reads all JSONL files in the given folder, fixes Unicode escape sequences, and rewrites the files.
+    Files are independent, so they are processed in parallel across CPU cores.
+    """
+    jsonl_files = [e.path for e in os.scandir(input_folder)
+                   if e.is_file() and e.name.endswith(".jsonl") and not e.name.startswith(".")]
 
-        print(f"[INFO] Fixed encoding for {file_path}")
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(_fix_one, jsonl_files))
 
-# Example usage:
-fix_jsonl_encoding("./dataset")  # Replace with your actual folder path
+if __name__ == "__main__":
+    # Example usage:
+    fix_jsonl_encoding("./dataset")  # Replace with your actual folder path
@@ -1,5 +1,6 @@
-from utils import start_vllm_server, stop_vllm_server, chat_completion, write_jsonl, read_jsonl
+from utils import start_vllm_server, stop_vllm_server, chat_completion, read_jsonl, iter_completed, atomic_write, client_threads
 import argparse
+import orjson
 from concurrent.futures import ThreadPoolExecutor
 import os
 
@@ -11,60 +12,119 @@ SYSTEM_PROMPTS = {
     "phi": "You are an Expert Philosopher. Your task is to provide a thorough and accurate response."
 }
 
-def gen_answers(input_file, output_file, api_base, model_name, max_tokens=256, temperature=0.7, threads=10):
+_GEN_INSTRUCTION = "Ensure that your answer is precise and complete, covering all important aspects of the question:\n"
+
+def get_domain(input_file):
     """
-    Generates answers for different datasets using tailored system prompts.
-    The dataset type is derived from the input file name (assumes file name starts with the domain prefix).
-    If a data item has type "multi-choice" or "single-choice", its question is combined with its choices.
+    Derives the domain from the input filename (e.g. "anthropology-ancient_society.jsonl" -> "anthropology").
     """
-    # Derive the domain from the input filename (e.g. "anthropology-ancient_society.jsonl" -> "anthropology")
-    base_name = os.path.basename(input_file)
-    domain = base_name.split("-")[0].lower()
-    system_prompt = SYSTEM_PROMPTS.get(
+    return os.path.basename(input_file).split("-")[0].lower()
+
+def get_system_prompt(domain):
+    """
+    Returns the tailored system prompt for a domain, falling back to a generic expert prompt.
+    """
+    return SYSTEM_PROMPTS.get(
         domain,
         "You are an Expert in your field. Your task is to provide a thorough and accurate response."
     )
+
+def build_messages(data_item, sys_message):
+    """
+    Builds the chat messages for one data item.
+    If a data item has choices (e.g. "multi-choice" or "single-choice"), its question is combined with them.
+    """
+    # Get the main question text.
+    question = data_item.get("question", "")
+    
+    # Combine with an instruction similar to the math script, appending the choices if present.
+    choices = data_item.get("choices")
+    if choices:
+        # Datasets store choices as one string; join only if given a list of options.
+        options = choices if isinstance(choices, str) else "\n".join(choices)
+        prompt = f"{_GEN_INSTRUCTION}{question}\nOptions:\n{options}"
+    else:
+        prompt = f"{_GEN_INSTRUCTION}{question}"
     
-    input_data_list = read_jsonl(input_file)
-    output_data_list = []
+    return [sys_message, {"role": "user", "content": prompt}]
 
-    def process_data(data_item, api_base, model_name, max_tokens=256, temperature=0.7):
-        # Get the main question text.
-        question = data_item.get("question", "")
-        
-        # Check if this is a multi-choice or single-choice question.
-        # q_type = data_item.get("type", "").lower()
-        # if q_type in ["multi-choice", "single-choice"]:
-        choices = data_item.get("choices", [])
-        if choices:
-            # Append the choices to the question prompt.
-            question += "\nOptions:\n" + "\n".join(choices)
-        
-        # Combine with an instruction similar to the math script.
-        prompt = "Ensure that your answer is precise and complete, covering all important aspects of the question:\n" + question
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt}
-        ]
-        
-        # Call the chat completion helper.
-        response = chat_completion(api_base=api_base, model_name=model_name, messages=messages,
-                                   max_tokens=max_tokens, temperature=temperature)
-        data_item["llm_answer"] = response
-        return data_item
+def prepare_items(input_file, sys_message=None):
+    """
+    Reads input_file and lazily yields (data_item, messages) pairs. This is the CPU-only half of
+    generation, so it can run ahead of time (e.g. while the vLLM server is still starting).
+    The system prompt is derived from the file name unless a shared sys_message is passed.
+    """
+    if sys_message is None:
+        sys_message = {"role": "system", "content": get_system_prompt(get_domain(input_file))}
+    for data_item in read_jsonl(input_file):
+        yield data_item, build_messages(data_item, sys_message)
 
-    with ThreadPoolExecutor(max_workers=threads) as executor:
-        futures = [
-            executor.submit(process_data, data_item, api_base, model_name, max_tokens, temperature)
-            for data_item in input_data_list
-        ]
-        for future in futures:
-            output_data_list.append(future.result())
+def _answer_item(prepared_item, api_base, model_name, max_tokens=256, temperature=0.7, cache=None, timeout=600):
+    data_item, messages = prepared_item
+    # Call the chat completion helper.
+    data_item["llm_answer"] = chat_completion(api_base=api_base, model_name=model_name, messages=messages,
+                                              max_tokens=max_tokens, temperature=temperature, cache=cache,
+                                              timeout=timeout)
+    return data_item
+
+def generate(prepared_items, output_file, api_base, model_name, max_tokens=256, temperature=0.7, threads=10,
+             timeout=600):
+    """
+    Sends prepared (data_item, messages) pairs to the server and streams the answered items to output_file.
+    timeout is the per-request read timeout in seconds.
+    """
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    # Duplicate prompts within this file are answered once; the cache is dropped with the file.
+    cache = {}
+    # Stream each answer to disk as soon as it completes instead of buffering them all. The output
+    # is only replaced once every item is answered, so a failed run leaves earlier results intact.
+    with atomic_write(output_file) as f, ThreadPoolExecutor(max_workers=threads) as executor:
+        # Items are consumed lazily and submitted with at most threads * 2 in flight.
+        for result in iter_completed(executor, _answer_item, prepared_items, threads * 2,
+                                     api_base, model_name, max_tokens, temperature, cache, timeout):
+            f.write(orjson.dumps(result) + b'\n')
 
-    write_jsonl(output_file, output_data_list)
     print(f"[INFO] Generation complete. Results saved to {output_file}.")
-    return
+
+def gen_answers(input_file, output_file, api_base, model_name, max_tokens=256, temperature=0.7, threads=10,
+                sys_message=None, timeout=600):
+    """
+    Generates answers for different datasets using tailored system prompts.
+    The dataset type is derived from the input file name (assumes file name starts with the domain prefix).
+    If a data item has type "multi-choice" or "single-choice", its question is combined with its choices.
+    A prebuilt sys_message can be passed to share one system message across files of the same domain.
+    """
+    generate(prepare_items(input_file, sys_message), output_file, api_base, model_name,
+             max_tokens, temperature, threads, timeout)
+
+def main(args):
+    """
+    Runs generation for the comma-separated input/output file lists in args (an argparse.Namespace
+    with the CLI's fields), so other scripts can drive gen_all in-process instead of via a subprocess.
+    If args.model_path is set, a vLLM server is started once for all files and stopped at the end;
+    args.max_num_seqs (optional) is passed through to it. args.threads defaults to max_num_seqs, else 128.
+    """
+    input_files = [s.strip() for s in args.input_file.split(',')]
+    max_num_seqs = getattr(args, "max_num_seqs", None)
+    threads = client_threads(getattr(args, "threads", None), max_num_seqs)
+    output_files = [s.strip() for s in args.output_file.split(',')]
+    
+    # Start the vLLM server once and keep it up for every input file.
+    process_id = None
+    if getattr(args, "model_path", None):
+        process_id = start_vllm_server(args.model_path, args.model_name, args.port, args.gpu,
+                                       max_num_seqs=max_num_seqs)
+    try:
+        for input_file, output_file in zip(input_files, output_files):
+            gen_answers(input_file, output_file, args.api_base, args.model_name,
+                        args.max_tokens, args.temperature, threads,
+                        timeout=getattr(args, "request_timeout", 600))
+    finally:
+        if process_id is not None:
+            stop_vllm_server(process_id)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate answers for various datasets using vLLM.")
@@ -77,32 +137,11 @@ if __name__ == "__main__":
     parser.add_argument("--model_path", type=str, default=None, help="Path to the model.")
     parser.add_argument("--port", type=int, default=8000, help="Port to host the model on.")
     parser.add_argument("--gpu", type=int, default=1, help="Number of GPUs to use.")
-    parser.add_argument("--threads", type=int, default=10, help="Number of threads to use for generation.")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Number of concurrent generation requests (default: --max_num_seqs if set, else 128).")
+    parser.add_argument("--request_timeout", type=float, default=600,
+                        help="Seconds to wait for each generation reply before retrying.")
+    parser.add_argument("--max_num_seqs", type=int, default=None,
+                        help="vLLM --max-num-seqs for a server started here (vLLM's default if unset).")
     
-    args = parser.parse_args()
-    
-    
-    if args.model_path:
-        process_id = start_vllm_server(args.model_path, args.model_name, args.port, args.gpu)
-        
-        
-        if ',' in args.input_file and ',' in args.output_file:
-            input_files = args.input_file.split(',').strip()
-            output_files = args.output_file.split(',').strip()
-            for i in range(len(input_files)):
-                gen_answers(input_files[i], output_files[i], args.api_base, args.model_name,
-                            args.max_tokens, args.temperature, args.threads)
-        else:
-            gen_answers(args.input_file, args.output_file, args.api_base, args.model_name,
-                        args.max_tokens, args.temperature, args.threads)
-        stop_vllm_server(process_id)
-    else:
-        if ',' in args.input_file and ',' in args.output_file:
-            input_files = args.input_file.split(',').strip()
-            output_files = args.output_file.split(',').strip()
-            for i in range(len(input_files)):
-                gen_answers(input_files[i], output_files[i], args.api_base, args.model_name,
-                            args.max_tokens, args.temperature, args.threads)
-        else:
-            gen_answers(args.input_file, args.output_file, args.api_base, args.model_name,
-                        args.max_tokens, args.temperature, args.threads)
+    main(parser.parse_args())
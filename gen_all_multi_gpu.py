@@ -1,55 +1,81 @@
 import os
 import argparse
-import subprocess
-from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from queue import Queue
 
+from gen_all import generate, get_domain, get_system_prompt, prepare_items
+from utils import client_threads, start_vllm_server_with_gpus, stop_vllm_server, prefetch_model_weights
+
 """
-Wrapper script to run gen_all.py for multiple models concurrently on different GPUs.
-Assumes gen_all.py accepts:
-  python gen_all.py --model_path <model_dir> \
-                    --input_file <in1,in2,...> \
-                    --output_file <out1,out2,...> \
-                    --api_base <api> --model_name <model> \
-                    [--max_tokens N] [--temperature T] [--threads K]
+Wrapper script to run gen_all.gen_answers for multiple models concurrently on different GPUs.
+Each worker hosts one model on its assigned GPU and generates answers for every input file
+in-process, so all workers share the pooled HTTP session in utils.
+Each model's server is stopped as soon as its files are done, freeing the GPU for the next model.
 """
 
+def launch_server(gpu_id, model_name, model_path, port_start, max_num_seqs):
+    """
+    Starts a vLLM server for model_name on gpu_id and returns (process, api_base).
+    """
+    port = port_start + gpu_id
+    process = start_vllm_server_with_gpus(model_path, model_name, port, [gpu_id], max_num_seqs=max_num_seqs)
+    return process, f"http://localhost:{port}"
+
+
+def plan_inputs(model_name, input_files, output_dir):
+    """
+    Returns (input_file, output_file, sys_message) triples for a model, grouped by domain
+    so each system message is built once and shared by all files of that domain.
+    """
+    by_domain = defaultdict(list)
+    for input_file in input_files:
+        output_file = os.path.join(output_dir, f"{model_name}_{os.path.basename(input_file)}")
+        by_domain[get_domain(input_file)].append((input_file, output_file))
+
+    plan = []
+    for domain, io_pairs in by_domain.items():
+        sys_message = {"role": "system", "content": get_system_prompt(domain)}
+        plan.extend((input_file, output_file, sys_message) for input_file, output_file in io_pairs)
+    return plan
+
+
+def run_gen(api_base, model_name, plan, first_items, max_tokens, temperature, threads, timeout=600):
+    """
+    Generates answers for every planned file against an already running server.
+    first_items holds the prompts already prepared for plan[0]; later files are prepared lazily.
+    """
+    print(f"[INFO] Generating for model '{model_name}' at {api_base}: "
+          f"{[(i, o) for i, o, _ in plan]}")
+    for index, (input_file, output_file, sys_message) in enumerate(plan):
+        items = first_items if index == 0 else prepare_items(input_file, sys_message)
+        generate(items, output_file, api_base, model_name, max_tokens, temperature, threads, timeout)
+
+
 def process_model(model_name, model_path, input_files, output_dir,
-                  port_start, max_tokens, temperature, threads, gpu_queue):
+                  port_start, max_tokens, temperature, threads, gpu_queue, max_num_seqs=None,
+                  request_timeout=600):
     gpu_id = gpu_queue.get()
+    process = None
     try:
-        # Restrict subprocess to assigned GPU
-        env = os.environ.copy()
-        env["CUDA_VISIBLE_DEVICES"] = str(gpu_id)
-        port = port_start + gpu_id
-        api_base = f"http://localhost:{port}"
-
-        # Prepare comma-separated inputs and outputs
-        in_str = ",".join(input_files)
-        out_files = [f"{model_name}_{os.path.basename(f)}" for f in input_files]
-        out_str = ",".join([os.path.join(output_dir, o) for o in out_files])
-
-        # Call gen_all.py with model_path and combined IO
-        gen_cmd = [
-            "python", "gen_all.py",
-            "--model_path", model_path,
-            "--input_file", in_str,
-            "--output_file", out_str,
-            "--api_base", api_base,
-            "--model_name", model_name,
-            "--max_tokens", str(max_tokens),
-            "--temperature", str(temperature),
-            "--threads", str(threads)
-        ]
-        print(f"[INFO] Generating for model '{model_name}' on GPU {gpu_id}: {in_str} -> {out_str}")
-        subprocess.run(gen_cmd, env=env, check=True)
+        plan = plan_inputs(model_name, input_files, output_dir)
+        with ThreadPoolExecutor(max_workers=1) as prep_pool:
+            # Read the first file and build its prompts while the server is starting up.
+            first_items = prep_pool.submit(list, prepare_items(plan[0][0], plan[0][2])) if plan else None
+            process, api_base = launch_server(gpu_id, model_name, model_path, port_start, max_num_seqs)
+            if plan:
+                run_gen(api_base, model_name, plan, first_items.result(), max_tokens, temperature, threads,
+                        request_timeout)
     finally:
+        # Free the GPU for the next model as soon as this one is done.
+        if process is not None:
+            stop_vllm_server(process)
         gpu_queue.put(gpu_id)
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Run gen_all.py across multiple models on separate GPUs."
+        description="Run gen_all across multiple models on separate GPUs."
     )
     parser.add_argument("--models_dir", required=True,
                         help="Directory containing model subfolders.")
@@ -63,16 +89,19 @@ def main():
                         help="Max tokens per generation.")
     parser.add_argument("--temperature", type=float, default=0.7,
                         help="Sampling temperature.")
-    parser.add_argument("--threads", type=int, default=10,
-                        help="Number of threads for gen_all.")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Concurrent generation requests per server (default: --max_num_seqs if set, else 128).")
+    parser.add_argument("--request_timeout", type=float, default=600,
+                        help="Seconds to wait for each generation reply before retrying.")
+    parser.add_argument("--max_num_seqs", type=int, default=None,
+                        help="vLLM --max-num-seqs per server (vLLM's default if unset).")
     parser.add_argument("--gpu_ids", type=str, default="0,1,2,3,4,5,6,7",
                         help="Comma-separated GPU IDs to use.")
     args = parser.parse_args()
 
     # Parse inputs
     input_files = [f.strip() for f in args.input_files.split(",")]
-    model_names = [d for d in os.listdir(args.models_dir)
-                   if os.path.isdir(os.path.join(args.models_dir, d))]
+    model_names = [e.name for e in os.scandir(args.models_dir) if e.is_dir()]
     gpu_ids = [int(x) for x in args.gpu_ids.split(",")]
 
     os.makedirs(args.output_dir, exist_ok=True)
@@ -80,16 +109,50 @@ def main():
     for gid in gpu_ids:
         gpu_queue.put(gid)
 
-    # Launch one worker per model
-    with ThreadPoolExecutor(max_workers=len(model_names)) as executor:
-        for model_name in model_names:
-            model_path = os.path.join(args.models_dir, model_name)
-            executor.submit(
-                process_model,
-                model_name, model_path, input_files, args.output_dir,
-                args.port_start, args.max_tokens,
-                args.temperature, args.threads, gpu_queue
-            )
+    # Models start in submission order as GPUs free up. The first len(gpu_ids) models start at once
+    # and are read cold by vLLM itself; only the next model waiting for a GPU is warmed. That readahead
+    # overlaps the loads in progress (at startup, and each time a model takes a freed GPU), but keeping
+    # it to one model bounds how much it can compete with them or evict their shards.
+    prefetcher = ThreadPoolExecutor(max_workers=1)
+    next_prefetch = len(gpu_ids)
+
+    def prefetch_next():
+        nonlocal next_prefetch
+        if next_prefetch < len(model_names):
+            prefetcher.submit(prefetch_model_weights, os.path.join(args.models_dir, model_names[next_prefetch]))
+            next_prefetch += 1
+
+    prefetch_next()
+
+    # One worker per GPU; the queue hands each worker a free GPU as models finish
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=len(gpu_ids)) as executor:
+            futures = {
+                executor.submit(
+                    process_model,
+                    model_name, os.path.join(args.models_dir, model_name), input_files, args.output_dir,
+                    args.port_start, args.max_tokens,
+                    args.temperature, client_threads(args.threads, args.max_num_seqs), gpu_queue, args.max_num_seqs,
+                    args.request_timeout
+                ): model_name
+                for model_name in model_names
+            }
+            for future in as_completed(futures):
+                # A GPU just freed up and the next waiting model takes it; warm the one after.
+                prefetch_next()
+                model_name = futures[future]
+                try:
+                    future.result()
+                    print(f"[INFO] Finished model '{model_name}'.")
+                except Exception as e:
+                    print(f"[ERROR] Model '{model_name}' failed: {e}")
+                    failed.append(model_name)
+    finally:
+        prefetcher.shutdown(wait=False, cancel_futures=True)
+
+    if failed:
+        raise RuntimeError(f"[ERROR] Generation failed for models: {', '.join(failed)}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
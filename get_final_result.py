@@ -1,10 +1,93 @@
 #!/usr/bin/env python
 import os
-import json
+import orjson
 import argparse
-import glob
+import importlib.util
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 
+# Types scored by average rating; every other type is scored by accuracy.
+RATING_TYPES = frozenset(("open", "fill"))
+# An eval_result key that is present but null counts as a wrong answer; only a missing key is excluded.
+EVAL_RESULT_NULLS = {"eval_result": False}
+
+def load_records(file_path, columns, null_values=None):
+    """
+    Reads a JSONL file into a DataFrame holding only the given columns.
+    Invalid lines and non-object items are skipped; missing fields become NaN.
+    null_values optionally maps a column to the value used when its key is present but null,
+    so that presence survives the conversion (which would otherwise turn it into NaN).
+    
+    The file is memory-mapped and each line is handed to orjson as a zero-copy
+    slice, so lines are never copied or decoded into Python strings.
+    """
+    items = []
+    # Bind hot-loop lookups to locals.
+    append = items.append
+    loads = orjson.loads
+    decode_error = orjson.JSONDecodeError
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return pd.DataFrame(columns=columns)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as buf:
+            find = mm.find
+            size = len(mm)
+            start = 0
+            while start < size:
+                end = find(b"\n", start)
+                if end == -1:
+                    end = size
+                if end > start:
+                    # orjson skips surrounding whitespace; blank lines fail to parse and are skipped.
+                    try:
+                        item = loads(buf[start:end])
+                    except decode_error:
+                        item = None
+                    if type(item) is dict:
+                        if null_values:
+                            for key, value in null_values.items():
+                                if key in item and item[key] is None:
+                                    item[key] = value
+                        append(item)
+                start = end + 1
+    return pd.DataFrame.from_records(items, columns=columns)
+
+def _group_mean(keys, values):
+    """
+    Per-key mean of values: keys are factorized to integer codes and summed/counted
+    with np.bincount, a single C pass over contiguous arrays.
+    """
+    codes, uniques = pd.factorize(keys)
+    sums = np.bincount(codes, weights=values, minlength=len(uniques))
+    counts = np.bincount(codes, minlength=len(uniques))
+    return dict(zip(uniques, sums / counts))
+
+def aggregate_scores(df):
+    """
+    Aggregates a DataFrame with 'type', 'eval_rating' and 'eval_result' columns by type.
+    Rating types (open, fill) get their average eval_rating; all other types get the
+    accuracy percentage of eval_result. Returns a dictionary mapping type -> score.
+    """
+    # Normalise the type and drop items without one.
+    types = df["type"].fillna("").astype(str).str.lower().str.strip()
+    keep = (types != "").to_numpy()
+    types = types[keep]
+    is_rating = types.isin(RATING_TYPES).to_numpy()
+
+    # Cast both metrics to fixed-width float columns; missing values become NaN.
+    rating = pd.to_numeric(df["eval_rating"][keep], errors="coerce").to_numpy(dtype=float)
+    result = df["eval_result"][keep]
+    has_result = result.notna().to_numpy()
+    passed = np.zeros(len(result))
+    passed[has_result] = result[has_result].astype(bool).to_numpy(dtype=float)
+
+    # One score column: the rating for rating types, 100/0 for all other types.
+    score = np.where(is_rating, rating, passed * 100)
+    valid = np.where(is_rating, ~np.isnan(rating), has_result)
+    return _group_mean(types[valid], score[valid])
+
 def process_file(file_path):
     """
     Process a single JSONL file to aggregate evaluation metrics by question type.
@@ -12,50 +95,85 @@ def process_file(file_path):
     For 'open' and 'fill' types (rating types), it calculates the average rating.
     For other types (binary True/False types), it calculates the accuracy percentage.
     
+    Items are loaded into a DataFrame and aggregated with vectorised array operations,
+    so the per-type math runs in numpy rather than in a Python loop.
     Returns a dictionary mapping each type to its aggregated score.
     """
-    totals = {}  # Sum of ratings or number of correct answers per type.
-    counts = {}  # Count of items per type.
-    
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                item = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-
-            # Get the type (assumed to be present and lowercased)
-            q_type = item.get("type", "").lower().strip()
-            if not q_type:
-                continue
-
-            # For rating types (open, fill), use eval_rating.
-            if q_type in ["open", "fill"]:
-                rating = item.get("eval_rating")
-                if rating is not None:
-                    totals[q_type] = totals.get(q_type, 0) + rating
-                    counts[q_type] = counts.get(q_type, 0) + 1
-            # For all other types, use eval_result (assumed boolean).
-            else:
-                if "eval_result" in item:
-                    result = item.get("eval_result")
-                    totals[q_type] = totals.get(q_type, 0) + (1 if result else 0)
-                    counts[q_type] = counts.get(q_type, 0) + 1
-
-    # Calculate aggregated scores.
-    agg = {}
-    for t in totals:
-        if counts[t] > 0:
-            if t in ["open", "fill"]:
-                # Average rating.
-                agg[t] = totals[t] / counts[t]
-            else:
-                # Accuracy percentage.
-                agg[t] = totals[t] / counts[t] * 100
-    return agg
+    return aggregate_scores(load_records(file_path, ["type", "eval_rating", "eval_result"], EVAL_RESULT_NULLS))
+
+def list_jsonl_files(folder_path):
+    """
+    Lists the .jsonl files in a folder with os.scandir, whose entries carry cached
+    file-type information, so no extra stat call is made per entry.
+    A missing folder has no files, as with glob.
+    """
+    if not os.path.isdir(folder_path):
+        return []
+    return [e.path for e in os.scandir(folder_path)
+            if e.is_file() and e.name.endswith(".jsonl") and not e.name.startswith(".")]
+
+def pool_chunksize(n_files):
+    """
+    Chunk size for mapping n_files over the process pool: one file per task for small folders,
+    larger batches for big folders to amortise IPC.
+    """
+    return max(1, n_files // ((os.cpu_count() or 1) * 4))
+
+def build_results_table(aggs):
+    """
+    Builds the summary DataFrame in one step from a mapping of file name -> {type: score}.
+    Each row is a file (files with no scores are kept) and each column an evaluation type, sorted.
+    """
+    df = pd.DataFrame.from_dict(aggs, orient="index").reindex(list(aggs))
+    df = df.reindex(columns=sorted(df.columns))
+    return df.rename_axis("FileName").reset_index()
+
+def output_engine(output_path):
+    """
+    Returns the writer engine for output_path's format: None for .csv, the first installed of
+    pyarrow/fastparquet for .parquet, and xlsxwriter (faster) or openpyxl for anything else (Excel).
+    Raises if no engine for the format is installed, so callers can check before doing any work.
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext == ".csv":
+        return None
+    candidates = ("pyarrow", "fastparquet") if ext == ".parquet" else ("xlsxwriter", "openpyxl")
+    for engine in candidates:
+        if importlib.util.find_spec(engine):
+            return engine
+    raise RuntimeError(f"[ERROR] Writing {output_path} needs {' or '.join(candidates)} installed.")
+
+def write_results(df, output_path):
+    """
+    Writes the summary table, choosing the format from the file extension:
+    .csv and .parquet are written directly; anything else is written as Excel.
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    engine = output_engine(output_path)
+    if ext == ".csv":
+        df.to_csv(output_path, index=False)
+    elif ext == ".parquet":
+        df.to_parquet(output_path, index=False, engine=engine)
+    else:
+        df.to_excel(output_path, index=False, engine=engine)
+
+def summarise_files(worker, files, output_path, *extra_args):
+    """
+    Runs worker(file, *extra) for every file in parallel across CPU cores, then writes
+    one summary row per file (keyed by its base name) to output_path.
+    extra_args are iterables zipped with files, as in Executor.map.
+    """
+    # Fail on a missing writer engine before aggregating anything.
+    output_engine(output_path)
+
+    # Files are independent, so aggregate them in parallel across CPU cores.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = executor.map(worker, files, *extra_args, chunksize=pool_chunksize(len(files)))
+        aggs = {os.path.basename(file_path): agg for file_path, agg in zip(files, results)}
+
+    # One row per file, one column per evaluation type.
+    write_results(build_results_table(aggs), output_path)
+    print(f"Results saved to {output_path}")
 
 def main(folder_path, output_excel):
     """
@@ -63,24 +181,7 @@ def main(folder_path, output_excel):
     and writes a summary Excel file where each row represents a file and each
     column corresponds to an evaluation type.
     """
-    jsonl_files = glob.glob(os.path.join(folder_path, "*.jsonl"))
-    results = []
-    all_types = set()
-
-    for file_path in jsonl_files:
-        agg = process_file(file_path)
-        row = {"FileName": os.path.basename(file_path)}
-        row.update(agg)
-        results.append(row)
-        all_types.update(agg.keys())
-    
-    # Create a DataFrame with a consistent column order.
-    columns = ["FileName"] + sorted(all_types)
-    df = pd.DataFrame(results, columns=columns)
-    
-    # Write to Excel.
-    df.to_excel(output_excel, index=False)
-    print(f"Results saved to {output_excel}")
+    summarise_files(process_file, list_jsonl_files(folder_path), output_excel)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -88,7 +189,9 @@ if __name__ == "__main__":
                     "For types 'open' and 'fill', the metric is the average rating. For all other types, the metric is the accuracy percentage."
     )
     parser.add_argument("folder", type=str, help="Folder containing JSONL files")
-    parser.add_argument("--output", type=str, default="results.xlsx", help="Output Excel file name")
+    parser.add_argument("--output", type=str, default="results.xlsx",
+                        help="Output file name; .csv and .parquet (needs pyarrow or fastparquet) are written as such, "
+                             "anything else as Excel")
     args = parser.parse_args()
     
     main(args.folder, args.output)
@@ -1,91 +1,64 @@
 #!/usr/bin/env python
 import os
-import json
 import argparse
-import glob
 import pandas as pd
 
+from get_final_result import EVAL_RESULT_NULLS, aggregate_scores, list_jsonl_files, load_records, summarise_files
+
+def _strip_text(col):
+    """
+    Vectorised str(x).strip() for a text column, with missing values as empty strings.
+    """
+    return col.fillna("").astype(str).str.strip()
+
+def _pair_key(question, answer):
+    """
+    Hashes (question, answer) column pairs into a uint64 key, so joins compare
+    fixed-width integers instead of Python string tuples.
+    """
+    return pd.util.hash_pandas_object(pd.DataFrame({"question": question, "answer": answer}), index=False)
+
 def load_reference(file_path):
     """
     Loads the reference JSONL file (which contains type information) and
-    returns a dictionary mapping (question, answer) tuples to their type.
+    returns a DataFrame mapping hashed (question, answer) keys to their type.
     """
-    ref_dict = {}
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                item = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            # Assume the reference item has 'question', 'answer', and 'type'
-            q = item.get("question", "").strip()
-            a = item.get("answer", "").strip()
-            t = item.get("type", "").lower().strip()
-            if q and a and t:
-                ref_dict[(q, a)] = t
-    return ref_dict
+    # Assume the reference item has 'question', 'answer', and 'type'
+    ref = load_records(file_path, ["question", "answer", "type"])
+    q = _strip_text(ref["question"])
+    a = _strip_text(ref["answer"])
+    t = _strip_text(ref["type"]).str.lower()
+    valid = (q != "") & (a != "") & (t != "")
+    ref = pd.DataFrame({"key": _pair_key(q[valid], a[valid]), "type": t[valid]})
+    # A repeated (question, answer) pair keeps its last type.
+    return ref.drop_duplicates(subset="key", keep="last")
 
-def process_eval_file(eval_file_path, ref_dict):
+def process_eval_file(eval_file_path, ref):
     """
-    Processes a single evaluation JSONL file. For each eval item,
-    matches the corresponding reference (by question and answer) to obtain the type.
+    Processes a single evaluation JSONL file. Eval items are joined with the
+    reference (by hashed question and answer) to obtain the type; unmatched items are dropped.
     
     For items of type 'open' or 'fill', it aggregates the numerical rating (field 'eval_rating').
     For all other types, it aggregates the binary evaluation (field 'eval_result') as accuracy.
     
     Returns a dictionary mapping type -> aggregated score.
     """
-    totals = {}   # Sum of ratings (or count of correct evaluations)
-    counts = {}   # Number of items per type
+    # In eval items, the fields 'question' and 'reference_answer' match 'question' and 'answer' in the reference file.
+    evals = load_records(eval_file_path, ["question", "reference_answer", "eval_rating", "eval_result"],
+                         EVAL_RESULT_NULLS)
+    evals = pd.DataFrame({
+        "key": _pair_key(_strip_text(evals["question"]), _strip_text(evals["reference_answer"])),
+        "eval_rating": evals["eval_rating"],
+        "eval_result": evals["eval_result"],
+    })
+    joined = evals.merge(ref, on="key", how="inner")
+    return aggregate_scores(joined)
 
-    with open(eval_file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                item = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-
-            # In eval items, assume the fields 'question' and 'reference_answer' match those in the reference file.
-            # (Alternatively, if the original 'answer' is preserved, adjust accordingly.)
-            q = item.get("question", "").strip()
-            a = item.get("reference_answer", "").strip()  # using 'reference_answer' from eval
-            key = (q, a)
-            t = ref_dict.get(key)
-            if not t:
-                # If matching by (question, answer) fails, try using just question (if that's acceptable)
-                # t = ref_dict.get((q, ""))
-                continue
-
-            # For rating types ("open" and "fill")
-            if t in ["open", "fill"]:
-                rating = item.get("eval_rating")
-                if rating is not None:
-                    totals[t] = totals.get(t, 0) + rating
-                    counts[t] = counts.get(t, 0) + 1
-            else:
-                # For binary evaluations (assumed to use 'eval_result')
-                if "eval_result" in item:
-                    result = item.get("eval_result")
-                    totals[t] = totals.get(t, 0) + (1 if result else 0)
-                    counts[t] = counts.get(t, 0) + 1
-
-    # Compute aggregated scores.
-    agg = {}
-    for typ in totals:
-        if counts[typ] > 0:
-            if typ in ["open", "fill"]:
-                # Average rating (expected between 1 and 5)
-                agg[typ] = totals[typ] / counts[typ]
-            else:
-                # Accuracy percentage
-                agg[typ] = totals[typ] / counts[typ] * 100
-    return agg
+def process_file_pair(eval_file, ref_file):
+    """
+    Loads the reference file and aggregates the matching eval file; runs in a worker process.
+    """
+    return process_eval_file(eval_file, load_reference(ref_file))
 
 def main(eval_folder, ref_folder, output_excel):
     """
@@ -95,29 +68,20 @@ def main(eval_folder, ref_folder, output_excel):
     
     The results are saved into an Excel file with one row per file and one column per type.
     """
-    eval_files = glob.glob(os.path.join(eval_folder, "*.jsonl"))
-    results = []
-    all_types = set()
+    eval_files = list_jsonl_files(eval_folder)
+    ref_names = {os.path.basename(f) for f in list_jsonl_files(ref_folder)}
+    matched_eval_files = []
+    ref_files = []
 
     for eval_file in eval_files:
         filename = os.path.basename(eval_file)
-        ref_file = os.path.join(ref_folder, filename)
-        if not os.path.exists(ref_file):
+        if filename not in ref_names:
             print(f"[WARN] Reference file not found for {filename}. Skipping.")
             continue
+        matched_eval_files.append(eval_file)
+        ref_files.append(os.path.join(ref_folder, filename))
 
-        ref_dict = load_reference(ref_file)
-        agg = process_eval_file(eval_file, ref_dict)
-        row = {"FileName": filename}
-        row.update(agg)
-        results.append(row)
-        all_types.update(agg.keys())
-
-    # Create a DataFrame with consistent columns: FileName plus one column per evaluation type.
-    columns = ["FileName"] + sorted(all_types)
-    df = pd.DataFrame(results, columns=columns)
-    df.to_excel(output_excel, index=False)
-    print(f"Results saved to {output_excel}")
+    summarise_files(process_file_pair, matched_eval_files, output_excel, ref_files)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -126,7 +90,9 @@ if __name__ == "__main__":
     )
     parser.add_argument("eval_folder", type=str, help="Folder containing evaluation JSONL files")
     parser.add_argument("ref_folder", type=str, help="Folder containing reference JSONL files (with type info)")
-    parser.add_argument("--output", type=str, default="results.xlsx", help="Output Excel file name")
+    parser.add_argument("--output", type=str, default="results.xlsx",
+                        help="Output file name; .csv and .parquet (needs pyarrow or fastparquet) are written as such, "
+                             "anything else as Excel")
     args = parser.parse_args()
     
     main(args.eval_folder, args.ref_folder, args.output)
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import orjson
+
+import eval_all
+
+
+def _write_jsonl(path, items):
+    with open(path, 'wb') as f:
+        for item in items:
+            f.write(orjson.dumps(item) + b'\n')
+
+
+def _read_jsonl(path):
+    with open(path, 'rb') as f:
+        return [orjson.loads(line) for line in f]
+
+
+class EvalJsonlOutputTest(unittest.TestCase):
+    def test_failed_run_keeps_existing_output(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_file = os.path.join(tmp, "gen.jsonl")
+            output_file = os.path.join(tmp, "keep.jsonl")
+            _write_jsonl(input_file, [{"question": "q", "llm_answer": "a", "answer": "a", "type": "judge"}])
+            _write_jsonl(output_file, [{"eval_result": True}])
+
+            # A missing input file must not truncate the previous output.
+            with self.assertRaises(FileNotFoundError):
+                eval_all.eval_jsonl(os.path.join(tmp, "nope.jsonl"), "http://localhost:8000", "m",
+                                    output_file=output_file)
+            # Neither must a judge call that fails part-way through the file.
+            with mock.patch.object(eval_all, "chat_completion", side_effect=RuntimeError("server down")):
+                with self.assertRaises(RuntimeError):
+                    eval_all.eval_jsonl(input_file, "http://localhost:8000", "m", threads=1,
+                                        output_file=output_file)
+
+            self.assertEqual(_read_jsonl(output_file), [{"eval_result": True}])
+            self.assertEqual(sorted(os.listdir(tmp)), ["gen.jsonl", "keep.jsonl"])
+
+    def test_successful_run_replaces_output(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_file = os.path.join(tmp, "gen.jsonl")
+            output_file = os.path.join(tmp, "out", "eval.jsonl")
+            _write_jsonl(input_file, [{"question": "q", "llm_answer": "a", "answer": "a", "type": "judge"}])
+
+            with mock.patch.object(eval_all, "chat_completion", return_value="The answer is correct."):
+                eval_all.eval_jsonl(input_file, "http://localhost:8000", "m", threads=1, output_file=output_file)
+
+            results = _read_jsonl(output_file)
+            self.assertEqual(len(results), 1)
+            self.assertTrue(results[0]["eval_result"])
+
+
+if __name__ == "__main__":
+    unittest.main()
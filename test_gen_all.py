@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from argparse import Namespace
+from unittest import mock
+
+import orjson
+
+import gen_all
+
+
+def _write_jsonl(path, items):
+    with open(path, 'wb') as f:
+        for item in items:
+            f.write(orjson.dumps(item) + b'\n')
+
+
+def _read_jsonl(path):
+    with open(path, 'rb') as f:
+        return [orjson.loads(line) for line in f]
+
+
+class GenAllMainTest(unittest.TestCase):
+    def test_comma_separated_files_are_all_processed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            in_a = os.path.join(tmp, "law-a.jsonl")
+            in_b = os.path.join(tmp, "econ-b.jsonl")
+            out_a = os.path.join(tmp, "out", "a.jsonl")
+            out_b = os.path.join(tmp, "out", "b.jsonl")
+            _write_jsonl(in_a, [{"question": "qa1"}, {"question": "qa2"}])
+            _write_jsonl(in_b, [{"question": "qb1", "choices": "A. x\nB. y"}])
+
+            args = Namespace(input_file=f"{in_a}, {in_b}", output_file=f"{out_a},{out_b}",
+                             api_base="http://localhost:8000", model_name="m",
+                             max_tokens=16, temperature=0.0, threads=2, model_path=None)
+            with mock.patch.object(gen_all, "chat_completion",
+                                   side_effect=lambda **kw: "answer: " + kw["messages"][1]["content"]):
+                gen_all.main(args)
+
+            answers_a = {r["question"]: r["llm_answer"] for r in _read_jsonl(out_a)}
+            answers_b = {r["question"]: r["llm_answer"] for r in _read_jsonl(out_b)}
+            self.assertEqual(set(answers_a), {"qa1", "qa2"})
+            self.assertEqual(set(answers_b), {"qb1"})
+
+    def test_string_choices_are_rendered_as_is(self):
+        messages = gen_all.build_messages({"question": "q", "choices": "A. x\nB. y"}, None)
+        self.assertTrue(messages[1]["content"].endswith("q\nOptions:\nA. x\nB. y"))
+
+
+class GenerateOutputTest(unittest.TestCase):
+    def test_failed_run_keeps_existing_output(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_file = os.path.join(tmp, "law-a.jsonl")
+            output_file = os.path.join(tmp, "out.jsonl")
+            _write_jsonl(input_file, [{"question": "q1"}, {"question": "q2"}])
+            _write_jsonl(output_file, [{"question": "old", "llm_answer": "kept"}])
+
+            # A missing input file must not truncate the previous output.
+            with self.assertRaises(FileNotFoundError):
+                gen_all.gen_answers(os.path.join(tmp, "nope.jsonl"), output_file, "http://localhost:8000", "m")
+            # Neither must a request that fails part-way through the file.
+            with mock.patch.object(gen_all, "chat_completion", side_effect=RuntimeError("server down")):
+                with self.assertRaises(RuntimeError):
+                    gen_all.gen_answers(input_file, output_file, "http://localhost:8000", "m", threads=1)
+
+            self.assertEqual(_read_jsonl(output_file), [{"question": "old", "llm_answer": "kept"}])
+            self.assertEqual(sorted(os.listdir(tmp)), ["law-a.jsonl", "out.jsonl"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from unittest import mock
+
+import orjson
+
+import gen_all
+import gen_all_multi_gpu
+
+
+class ProcessModelTest(unittest.TestCase):
+    def test_workers_share_one_input_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_file = os.path.join(tmp, "law-shared.jsonl")
+            with open(input_file, 'wb') as f:
+                for i in range(2000):
+                    f.write(orjson.dumps({"question": f"q{i}"}) + b'\n')
+                f.write(b'{not json\n')
+            with open(input_file, 'rb') as f:
+                original = f.read()
+
+            model_names = [f"m{i}" for i in range(4)]
+            gpu_queue = Queue()
+            for gpu_id in range(len(model_names)):
+                gpu_queue.put(gpu_id)
+
+            def fake_launch(gpu_id, model_name, model_path, port_start, max_num_seqs):
+                return mock.Mock(), f"http://localhost:{port_start + gpu_id}"
+
+            with mock.patch.object(gen_all_multi_gpu, "launch_server", side_effect=fake_launch), \
+                    mock.patch.object(gen_all_multi_gpu, "stop_vllm_server") as stop, \
+                    mock.patch.object(gen_all, "chat_completion", return_value="answer"):
+                with ThreadPoolExecutor(max_workers=len(model_names)) as executor:
+                    futures = [
+                        executor.submit(gen_all_multi_gpu.process_model, model_name, "unused", [input_file],
+                                        os.path.join(tmp, "out"), 8000, 16, 0.0, 4, gpu_queue)
+                        for model_name in model_names
+                    ]
+                    for future in futures:
+                        future.result()
+
+            # Every worker read the same file without touching it, and every server was stopped.
+            with open(input_file, 'rb') as f:
+                self.assertEqual(f.read(), original)
+            self.assertEqual(sorted(os.listdir(tmp)), ["law-shared.jsonl", "out"])
+            self.assertEqual(stop.call_count, len(model_names))
+            self.assertEqual(gpu_queue.qsize(), len(model_names))
+            for model_name in model_names:
+                with open(os.path.join(tmp, "out", f"{model_name}_law-shared.jsonl"), 'rb') as f:
+                    self.assertEqual(sum(1 for _ in f), 2000)
+
+
+if __name__ == "__main__":
+    unittest.main()
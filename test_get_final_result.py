@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+
+import get_final_result
+import get_result_temp
+
+
+def _write_lines(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n" if lines else "")
+
+
+class ReportScoresTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _file(self, name, lines):
+        path = os.path.join(self.tmp, name)
+        _write_lines(path, lines)
+        return path
+
+    def assertScores(self, actual, expected):
+        self.assertEqual(set(actual), set(expected))
+        for t, score in expected.items():
+            self.assertAlmostEqual(actual[t], score, msg=t)
+
+    def test_process_file(self):
+        path = self._file("eval.jsonl", [
+            '{"type": "Open ", "eval_rating": 4}',
+            '{"type": "open", "eval_rating": 2}',
+            '{"type": "OPEN", "eval_rating": null}',     # null rating: skipped
+            '{"type": "open"}',                          # missing rating: skipped
+            '{"type": " Judge", "eval_result": true}',
+            '{"type": "judge", "eval_result": null}',    # null result: counts as wrong
+            '{"type": "judge", "eval_result": false}',
+            '{"type": "judge"}',                         # missing result: skipped
+            '{"eval_result": true}',                     # missing type: skipped
+            '{"type": "", "eval_result": true}',         # empty type: skipped
+            '{not json',
+            '',
+            '{"type": "fill", "eval_rating": 3}',
+        ])
+        self.assertScores(get_final_result.process_file(path),
+                          {"open": 3.0, "judge": 100 / 3, "fill": 3.0})
+
+    def test_process_file_empty(self):
+        self.assertEqual(get_final_result.process_file(self._file("empty.jsonl", [])), {})
+
+    def test_process_eval_file(self):
+        ref = self._file("ref.jsonl", [
+            '{"question": " q1 ", "answer": "a1", "type": "Single-Choice"}',
+            '{"question": "q2", "answer": "a2", "type": "judge"}',
+            '{"question": "q2", "answer": "a2", "type": "open"}',   # duplicate: last type wins
+            '{"question": "q3", "answer": "", "type": "judge"}',    # empty answer: not a reference
+            '{"question": "q4", "answer": "a4"}',                   # missing type: not a reference
+            '{not json',
+        ])
+        evals = self._file("eval.jsonl", [
+            '{"question": "q1", "reference_answer": " a1", "eval_result": true}',
+            '{"question": "q1", "reference_answer": "a1", "eval_result": null}',
+            '{"question": "q1", "reference_answer": "a1"}',
+            '{"question": "q2", "reference_answer": "a2", "eval_rating": 5}',
+            '{"question": "q2", "reference_answer": "a2", "eval_rating": null}',
+            '{"question": "q3", "reference_answer": "", "eval_result": true}',
+            '{"question": "q4", "reference_answer": "a4", "eval_result": true}',
+            '{"question": "qx", "reference_answer": "a1", "eval_result": true}',
+            '{"reference_answer": "a1", "eval_result": true}',
+            '{not json',
+        ])
+        self.assertScores(get_result_temp.process_eval_file(evals, get_result_temp.load_reference(ref)),
+                          {"single-choice": 50.0, "open": 5.0})
+
+    def test_process_eval_file_empty(self):
+        ref = self._file("ref.jsonl", ['{"question": "q", "answer": "a", "type": "judge"}'])
+        evals = self._file("eval.jsonl", ['{"question": "q", "reference_answer": "a", "eval_result": true}'])
+        empty = self._file("empty.jsonl", [])
+        self.assertEqual(get_result_temp.process_file_pair(empty, ref), {})
+        self.assertEqual(get_result_temp.process_file_pair(evals, empty), {})
+        self.assertScores(get_result_temp.process_file_pair(evals, ref), {"judge": 100.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import subprocess
+import unittest
+from unittest import mock
+
+import requests
+
+import utils
+
+
+def _response(status_code, content="ok"):
+    r = requests.Response()
+    r.status_code = status_code
+    r._content = b'{"choices": [{"message": {"content": "%s"}}]}' % content.encode()
+    return r
+
+
+class ChatCompletionRetryTest(unittest.TestCase):
+    def _call(self, responses):
+        with mock.patch.object(utils._SESSION, "post", side_effect=responses) as post, \
+                mock.patch.object(utils.time, "sleep") as sleep:
+            try:
+                return utils.chat_completion("http://localhost:8000", "m", [], timeout=30), post, sleep
+            except requests.exceptions.RequestException as e:
+                return e, post, sleep
+
+    def test_overloaded_and_server_errors_are_retried(self):
+        result, post, sleep = self._call([_response(429), _response(503), _response(200, "answer")])
+        self.assertEqual(result, "answer")
+        self.assertEqual(post.call_count, 3)
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [1, 2])
+        self.assertEqual(post.call_args.kwargs["timeout"], (5, 30))
+
+    def test_client_errors_are_not_retried(self):
+        result, post, sleep = self._call([_response(400)])
+        self.assertIsInstance(result, requests.exceptions.HTTPError)
+        self.assertEqual(post.call_count, 1)
+        sleep.assert_not_called()
+
+    def test_gives_up_after_max_attempts(self):
+        result, post, _ = self._call([_response(500)] * 3)
+        self.assertIsInstance(result, requests.exceptions.HTTPError)
+        self.assertEqual(post.call_count, 3)
+
+        result, post, _ = self._call([requests.exceptions.ReadTimeout()] * 3)
+        self.assertIsInstance(result, requests.exceptions.ReadTimeout)
+        self.assertEqual(post.call_count, 3)
+
+
+class NumaPinningTest(unittest.TestCase):
+    def setUp(self):
+        utils._numactl_can_bind.cache_clear()
+
+    def _launch(self, probe_ok=True, environ=None):
+        probe = mock.Mock(side_effect=None if probe_ok else subprocess.CalledProcessError(1, "numactl"))
+        with mock.patch.object(utils.shutil, "which", return_value="/usr/bin/numactl"), \
+                mock.patch.object(utils, "gpu_numa_node", return_value=1), \
+                mock.patch.object(utils.subprocess, "run", probe), \
+                mock.patch.object(utils.subprocess, "Popen") as popen, \
+                mock.patch.object(utils, "wait_for_server"), \
+                mock.patch.dict(os.environ, environ or {}):
+            if not environ:
+                os.environ.pop("CUDA_DEVICE_ORDER", None)
+            utils.start_vllm_server_with_gpus("/models/m", "m", 8000, [2])
+        command, env = popen.call_args.args[0], popen.call_args.kwargs["env"]
+        return command, env, probe
+
+    def test_pins_to_the_gpus_node_when_numactl_may_bind(self):
+        command, env, probe = self._launch()
+        self.assertEqual(command[:5], ["numactl", "--cpunodebind", "1", "--membind", "1"])
+        self.assertEqual(probe.call_args.args[0][-1], "true")
+        self.assertEqual(env["CUDA_DEVICE_ORDER"], "PCI_BUS_ID")
+        self.assertEqual(env["CUDA_VISIBLE_DEVICES"], "2")
+
+    def test_starts_unpinned_when_numactl_is_not_permitted(self):
+        command, _, _ = self._launch(probe_ok=False)
+        self.assertEqual(command[0], "python")
+
+    def test_respects_a_user_set_device_order(self):
+        command, env, probe = self._launch(environ={"CUDA_DEVICE_ORDER": "FASTEST_FIRST"})
+        self.assertEqual(env["CUDA_DEVICE_ORDER"], "FASTEST_FIRST")
+        self.assertEqual(command[0], "python")
+        probe.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,50 +1,76 @@
 # utils.py
 import os
 import time
-import json
+import functools
+import hashlib
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Dict, Any, List
+import shutil
 import subprocess
-from openai import OpenAI
-import json
-import os
-import codecs
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+from contextlib import contextmanager
+
+
+# Read once at import: new output files get the same permissions open() would give them.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 
+@contextmanager
+def atomic_write(file_path):
+    """
+    Yields a binary file for writing file_path's new contents. The data goes to a unique temp file
+    next to file_path, which replaces file_path only if the block finishes without an error, so a
+    failed run never truncates or half-overwrites an existing file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
 def filter_and_fix_file(file_path):
     """
-    Reads a JSONL file, removes invalid lines, and overwrites the original file with only valid lines.
+    Reads a JSONL file, removes invalid lines, and atomically replaces the original file with only valid lines.
     """
-    valid_lines = []
-    
-    with open(file_path, 'r', encoding='utf-8') as infile:
+    # Stream valid lines into a temp file, then swap it in. Lines stay raw bytes:
+    # orjson skips surrounding whitespace, so no decode or strip copy is made per line.
+    with open(file_path, 'rb') as infile, atomic_write(file_path) as outfile:
         for line in infile:
-            if line.strip():  # Check if the line is not empty
-                try:
-                    json.loads(line)  # Attempt to load the line as JSON
-                    valid_lines.append(line)  # Store valid lines
-                except json.JSONDecodeError:
-                    print(f"Invalid JSON line removed: {line.strip()}")  # Log invalid line
-    
-    # Overwrite the original file with valid lines
-    with open(file_path, 'w', encoding='utf-8') as outfile:
-        outfile.writelines(valid_lines)
+            if line.isspace():  # Skip empty lines
+                continue
+            try:
+                orjson.loads(line)  # Attempt to load the line as JSON
+                outfile.write(line)  # Keep valid lines
+            except orjson.JSONDecodeError:
+                print(f"Invalid JSON line removed: {line.decode('utf-8', 'replace').strip()}")  # Log invalid line
 
 def read_jsonl(file_path):
     """
     Reads a JSONL file, ensuring proper UTF-8 handling and fixing any Unicode escape sequences.
-    Yields each JSON object as a dictionary.
+    Yields each JSON object as a dictionary; invalid lines are skipped and the file is never modified,
+    so several readers can share one input file.
     """
-    filter_and_fix_file(file_path)  # Ensure invalid lines are removed
-    with codecs.open(file_path, 'r', encoding='utf-8') as f:
+    with open(file_path, 'rb') as f:
         for line in f:
-            line = line.strip()
-            if line:
-                try:
-                    data = json.loads(line)  # Load JSON and decode Unicode properly
-                    yield data
-                except json.JSONDecodeError as e:
-                    print(f"[ERROR] Skipping invalid JSON line in {file_path}: {line} - {e}")
+            if line.isspace():
+                continue
+            try:
+                data = orjson.loads(line)  # orjson decodes UTF-8 and ignores the trailing newline
+                yield data
+            except orjson.JSONDecodeError as e:
+                print(f"[ERROR] Skipping invalid JSON line in {file_path}: {line.decode('utf-8', 'replace').strip()} - {e}")
 
 
 def write_jsonl(file_path, data_list, append=False):
@@ -52,45 +78,121 @@ def write_jsonl(file_path, data_list, append=False):
     Writes a list of dictionaries to a JSONL file with proper UTF-8 encoding.
     Ensures Unicode characters are stored correctly without escaping.
     """
-    mode = 'a' if append else 'w'
+    mode = 'ab' if append else 'wb'
 
     # Ensure the directory exists before writing
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
-    with codecs.open(file_path, mode, encoding='utf-8') as f:
+    with open(file_path, mode) as f:
         for item in data_list:
-            # Decode any escaped Unicode characters before writing
-            json_line = json.dumps(item, ensure_ascii=False)
-            json_line = json_line.encode('utf-8').decode('utf-8')  # Ensures proper encoding
-            
-            f.write(json_line + '\n')
+            # orjson emits UTF-8 bytes and never escapes non-ASCII characters
+            f.write(orjson.dumps(item) + b'\n')
             
 
-def chat_completion(api_base: str, model_name: str, messages: list, max_tokens=256, temperature=0.7):
+def iter_completed(executor, fn, items, max_in_flight, *args):
+    """
+    Submits fn(item, *args) to the executor for each item, keeping at most max_in_flight
+    tasks pending at once, and yields their results in completion order.
+    items may be a generator; it is consumed lazily as slots free up.
+    """
+    in_flight = set()
+    for item in items:
+        if len(in_flight) >= max_in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        in_flight.add(executor.submit(fn, item, *args))
+    for future in as_completed(in_flight):
+        yield future.result()
+
+
+# Requests kept in flight per server when neither --threads nor --max_num_seqs is given. vLLM batches up
+# to 256 sequences by default, so a handful of client threads would leave most of its batch empty.
+DEFAULT_CONCURRENCY = 128
+
+
+def client_threads(threads=None, max_num_seqs=None):
+    """
+    Number of concurrent requests to send: threads if given, otherwise the server's max_num_seqs
+    (so the client fills exactly the batch it asked vLLM for), otherwise DEFAULT_CONCURRENCY.
+    """
+    return threads or max_num_seqs or DEFAULT_CONCURRENCY
+
+
+# One pooled session shared by every worker thread, so connections to the server are kept alive.
+# Adapter retries are off: chat_completion does its own retries with backoff, and stacking
+# both layers multiplied the attempts against a refused connection.
+_SESSION = requests.Session()
+_SESSION.mount('http://', HTTPAdapter(pool_connections=64, pool_maxsize=128, max_retries=0))
+_SESSION.mount('https://', HTTPAdapter(pool_connections=64, pool_maxsize=128, max_retries=0))
+
+
+def chat_completion(api_base: str, model_name: str, messages: list, max_tokens=256, temperature=0.7,
+                    cache: Dict[bytes, str] = None, timeout: float = 600, max_attempts: int = 3):
     """
-    Generic helper that uses the new openai client interface to get a chat completion.
+    Generic helper that posts to an OpenAI-compatible /chat/completions endpoint
+    over the shared session and returns the reply text.
+    If a cache dict is given, replies are stored in it keyed by a hash of the full request, so duplicate
+    prompts sharing that dict cost a single call; callers scope it to one file so it stays small.
+    timeout is the read timeout in seconds (long generations under load need minutes; connecting gets 5s).
+    Timed-out or dropped requests and 429/5xx replies are retried up to max_attempts times with
+    exponential backoff, so a stuck or overloaded server can't hold a worker forever.
     """
     
     if '/v1' not in api_base:
         api_base = api_base + '/v1'
     
-    client = OpenAI(base_url=api_base, api_key="xxx")  # point to the local vLLM server
-    completion = client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-        max_tokens=max_tokens,
-        temperature=temperature
-    )
-    return completion.choices[0].message.content
+    if cache is not None:
+        prompt_hash = hashlib.blake2b(
+            orjson.dumps([api_base, model_name, messages, max_tokens, temperature]), digest_size=16
+        ).digest()
+        # Single dict reads/writes are atomic, so worker threads can share the cache without a lock
+        cached = cache.get(prompt_hash)
+        if cached is not None:
+            return cached
+    
+    for attempt in range(1, max_attempts + 1):
+        try:
+            r = _SESSION.post(
+                api_base.rstrip('/') + '/chat/completions',
+                headers={"Authorization": "Bearer xxx"},  # point to the local vLLM server
+                json={
+                    "model": model_name,
+                    "messages": messages,
+                    "max_tokens": max_tokens,
+                    "temperature": temperature
+                },
+                timeout=(5, timeout)
+            )
+            # Overloaded (429) and server-side (5xx) errors are transient; anything else is final
+            if r.status_code != 429 and r.status_code < 500:
+                break
+            error = f"HTTP {r.status_code}"
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            if attempt == max_attempts:
+                raise
+            error = e
+        if attempt == max_attempts:
+            break
+        delay = min(2 ** (attempt - 1), 30)
+        print(f"[WARN] Request to {api_base} failed (attempt {attempt}/{max_attempts}): {error}. Retrying in {delay}s.")
+        time.sleep(delay)
+    r.raise_for_status()
+    content = r.json()["choices"][0]["message"]["content"]
+    
+    if cache is not None:
+        cache[prompt_hash] = content
+    return content
 
 
 
-def start_vllm_server(model_path: str, model_name: str, port: int, gpu: int = 1):
+def start_vllm_server(model_path: str, model_name: str, port: int, gpu: int = 1, max_num_seqs: int = None):
     """
     Launches a vLLM OpenAI API server via subprocess.
     model_path: The path or name of the model you want to host
     port: Which port to host on
     gpu: The tensor-parallel-size (number of GPUs)
+    max_num_seqs: Max sequences vLLM batches per step (vLLM default if None).
     """
     # Command to activate conda environment and start the server
     command = [
@@ -102,17 +204,67 @@ def start_vllm_server(model_path: str, model_name: str, port: int, gpu: int = 1)
         f'--port={port}',
         '--trust-remote-code'
     ]
+    if max_num_seqs:
+        command.append(f'--max-num-seqs={max_num_seqs}')
 
     process = subprocess.Popen(command, shell=False)
     
-    wait_for_server(f"http://localhost:{port}", 600)
+    wait_for_server(f"http://localhost:{port}", 600, process)
     
     print(f"[INFO] Started vLLM server for model '{model_path}' on port {port} (GPU={gpu}).")
 
     return process
 
 
-def start_vllm_server_with_gpus(model_path: str, model_name: str, port: int, gpus: List[int]):
+def gpu_numa_node(gpu: int):
+    """
+    Returns the NUMA node the given GPU's PCIe device is attached to, or None if it cannot be
+    determined (no nvidia-smi, no NUMA information, or a single-node machine reporting -1).
+    gpu is an index in PCI bus order (nvidia-smi's numbering, CUDA_DEVICE_ORDER=PCI_BUS_ID).
+    """
+    try:
+        bus_id = subprocess.run(
+            ['nvidia-smi', f'--id={gpu}', '--query-gpu=pci.bus_id', '--format=csv,noheader'],
+            capture_output=True, text=True, check=True, timeout=10
+        ).stdout.strip()
+        # nvidia-smi reports an 8-digit PCI domain ("00000000:3B:00.0"), sysfs uses 4 ("0000:3b:00.0")
+        with open(f"/sys/bus/pci/devices/{bus_id[-12:].lower()}/numa_node") as f:
+            node = int(f.read().strip())
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+    return node if node >= 0 else None
+
+@functools.lru_cache(maxsize=None)
+def _numactl_can_bind(node: str) -> bool:
+    """
+    Probes once per node whether numactl may bind to it here. Containers without CAP_SYS_NICE
+    (e.g. Docker's default seccomp profile) block set_mempolicy, and numactl then exits at once.
+    """
+    try:
+        subprocess.run(['numactl', '--cpunodebind', node, '--membind', node, 'true'],
+                       capture_output=True, check=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        print(f"[WARN] numactl cannot bind to NUMA node {node}; starting vLLM unpinned.")
+        return False
+    return True
+
+def numa_prefix(gpus: List[int]) -> List[str]:
+    """
+    Returns a numactl command prefix binding CPUs and memory to the NUMA node local to the GPUs,
+    or an empty list when numactl is missing or not permitted, or the GPUs don't share a single known node.
+    """
+    if shutil.which('numactl') is None:
+        return []
+    nodes = {gpu_numa_node(gpu) for gpu in gpus}
+    if len(nodes) != 1 or None in nodes:
+        return []
+    node = str(nodes.pop())
+    if not _numactl_can_bind(node):
+        return []
+    return ['numactl', '--cpunodebind', node, '--membind', node]
+
+def start_vllm_server_with_gpus(model_path: str, model_name: str, port: int, gpus: List[int],
+                                max_num_seqs: int = None):
     """
     Launches a vLLM OpenAI API server via subprocess with specific GPUs assigned.
 
@@ -120,15 +272,23 @@ def start_vllm_server_with_gpus(model_path: str, model_name: str, port: int, gpu
     model_path: str - The path or name of the model you want to host.
     model_name: str - The name of the model to be served.
     port: int - The port to host the server on.
-    gpus: List[int] - List of GPU indices to be assigned for this server.
+    gpus: List[int] - List of GPU indices (in PCI bus order, as listed by nvidia-smi) to be assigned for this server.
+    max_num_seqs: int - Max sequences vLLM batches per step (vLLM default if None).
 
     Returns:
     process: subprocess.Popen - The process running the vLLM server.
     """
     gpu_list = ",".join(map(str, gpus))
-    os.environ['CUDA_VISIBLE_DEVICES'] = gpu_list
-
-    command = [
+    # Copy the environment rather than mutating os.environ, so concurrent launches from threads don't race
+    env = os.environ.copy()
+    # Number GPUs in PCI bus order, as nvidia-smi does, so the NUMA lookup and CUDA agree on each index.
+    # A user-set order is respected; the NUMA lookup is then skipped since the indices may not match.
+    env.setdefault('CUDA_DEVICE_ORDER', 'PCI_BUS_ID')
+    env['CUDA_VISIBLE_DEVICES'] = gpu_list
+
+    # Keep the server's CPU threads and host memory on the socket that drives its GPUs
+    prefix = numa_prefix(gpus) if env['CUDA_DEVICE_ORDER'] == 'PCI_BUS_ID' else []
+    command = prefix + [
         'python', '-m', 'vllm.entrypoints.openai.api_server',
         f'--model={model_path}',
         f'--served-model-name={model_name}',
@@ -137,15 +297,70 @@ def start_vllm_server_with_gpus(model_path: str, model_name: str, port: int, gpu
         f'--port={port}',
         '--trust-remote-code'
     ]
+    if max_num_seqs:
+        command.append(f'--max-num-seqs={max_num_seqs}')
 
-    process = subprocess.Popen(command, shell=False, env=os.environ.copy())
+    process = subprocess.Popen(command, shell=False, env=env)
     
-    wait_for_server(f"http://localhost:{port}", 600)
+    wait_for_server(f"http://localhost:{port}", 600, process)
 
-    print(f"[INFO] Started vLLM server for model '{model_name}' on port {port} with GPUs {gpu_list}.")
+    print(f"[INFO] Started vLLM server for model '{model_name}' on port {port} with GPUs {gpu_list}"
+          f"{' (NUMA-pinned)' if command[0] == 'numactl' else ''}.")
 
     return process
 
+def available_memory_bytes():
+    """
+    Returns the memory available for new page cache (MemAvailable), or None if it is unknown.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def prefetch_model_weights(model_path: str):
+    """
+    Hints the OS to pull a model's weight files into the page cache ahead of vLLM loading them.
+    Uses posix_fadvise(WILLNEED) where available (asynchronous readahead), otherwise reads
+    the files through in 1MB chunks. Models larger than the available memory are skipped, since
+    reading them would only evict the shards other servers are loading right now.
+    Errors are logged and ignored since this is only a hint.
+    """
+    try:
+        weight_files = [e for e in os.scandir(model_path)
+                        if e.is_file() and e.name.endswith((".safetensors", ".bin", ".pt"))]
+        total_bytes = sum(e.stat().st_size for e in weight_files)
+    except OSError as e:
+        print(f"[WARN] Could not list weight files in {model_path}: {e}")
+        return
+
+    available = available_memory_bytes()
+    if available is not None and total_bytes > available:
+        print(f"[WARN] Skipping prefetch for {model_path}: {total_bytes >> 20} MB of weights "
+              f"exceeds {available >> 20} MB available memory.")
+        return
+
+    for entry in weight_files:
+        try:
+            if hasattr(os, "posix_fadvise"):
+                fd = os.open(entry.path, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            else:
+                with open(entry.path, 'rb') as f:
+                    while f.read(1 << 20):
+                        pass
+        except OSError as e:
+            print(f"[WARN] Could not prefetch {entry.path}: {e}")
+    print(f"[INFO] Prefetched {len(weight_files)} weight files for {model_path}.")
+
+
 def allocate_gpus(total_gpus: int, processes: int) -> List[List[int]]:
     """
     Allocate GPUs for multiple processes.
@@ -175,12 +390,18 @@ def allocate_gpus(total_gpus: int, processes: int) -> List[List[int]]:
 
 
 
-def wait_for_server(url: str, timeout: int = 600):
+def wait_for_server(url: str, timeout: int = 600, process=None):
     """
     Polls the server's /models endpoint until it responds with HTTP 200 or times out.
+    Polling starts at 0.25s and backs off to 2s, so small models are picked up quickly.
+    If the server's process is given, a crashed server fails fast instead of waiting out the
+    timeout, and a server that never comes up is terminated before raising.
     """
     start_time = time.time()
+    delay = 0.25
     while True:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"[ERROR] Server process for {url} exited with code {process.returncode} before becoming ready.")
         try:
             r = requests.get(url + "/v1/models", timeout=3)
             if r.status_code == 200:
@@ -189,8 +410,11 @@ def wait_for_server(url: str, timeout: int = 600):
         except Exception:
             pass
         if time.time() - start_time > timeout:
+            if process is not None:
+                stop_vllm_server(process)
             raise RuntimeError(f"[ERROR] Server did not start at {url} within {timeout} seconds.")
-        time.sleep(2)
+        time.sleep(delay)
+        delay = min(delay * 2, 2)
         
 def stop_vllm_server(process):
     process.terminate()